@@ -0,0 +1,36 @@
+"""Gunicorn settings for serving the FastAPI app in production.
+
+Launch with:
+    python main.py --export-only   # once, and again after replacing the weights
+    gunicorn -c gunicorn_conf.py main:app
+
+Behind nginx, serve the static files directly so the Python worker never touches them
+(uploads already get a long-lived immutable Cache-Control from the app):
+    location /static/ {
+        alias /path/to/accident-damage-detection/static/;
+        sendfile on;
+        tcp_nopush on;
+    }
+    location /static/uploads/ {
+        alias /path/to/accident-damage-detection/static/uploads/;
+        sendfile on;
+        tcp_nopush on;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+"""
+
+bind = '0.0.0.0:8000'
+
+# Each worker loads its own copy of the model and its own batching queue.
+# A single worker lets concurrent requests batch together; if model memory allows
+# replicating it, raise this to the number of CPU cores (or GPUs).
+workers = 1
+
+# Uvicorn's worker runs the ASGI event loop; blocking inference is already moved to
+# Starlette's threadpool, so gthread-style `threads` are not needed here.
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Workers silent for longer than this are restarted, and that includes the time spent
+# importing main (model load, export, warmup). A TensorRT export can take several minutes,
+# so export first with `python main.py --export-only` whenever the weights change.
+timeout = 60
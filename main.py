@@ -0,0 +1,485 @@
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import RedirectResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartParser
+from ultralytics import YOLO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
+import numpy as np
+import torch
+import cv2
+import os
+import json
+import secrets
+import time
+import threading
+import sys
+
+# --- CONFIGURATION ---
+# 1. Path to your model weights (You MUST update this path on your local system)
+# NOTE: This is a placeholder. Update to your actual path like "C:/path/to/best.pt"
+MODEL_PATH = r"C:\Users\rayal\OneDrive\Desktop\accident-damage-detection\models\model weights\best.pt"
+
+# 2. Path to your pricing JSON file
+PRICE_JSON_PATH = "car_parts_prices.json"
+
+# 3. Define UPLOAD folder relative to the main.py location
+UPLOAD_FOLDER = 'static/uploads'
+
+# 4. Max request size for POST /predict, enforced from Content-Length before the body is
+# parsed (FastAPI has no built-in equivalent of Flask's MAX_CONTENT_LENGTH)
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # Max 16MB file size
+
+# Starlette spools multipart files over 1MB to a temporary file on disk. Since bodies
+# above MAX_CONTENT_LENGTH are rejected up front, accepted uploads are kept in memory
+# instead, at the cost of up to MAX_CONTENT_LENGTH of RAM per in-flight upload.
+MultiPartParser.spool_max_size = MAX_CONTENT_LENGTH
+
+# 5. Size cap for UPLOAD_FOLDER: a background thread deletes the oldest files every
+# UPLOAD_CLEAN_INTERVAL seconds so the served working set stays small enough for the page cache
+MAX_UPLOAD_FOLDER_BYTES = 500 * 1024 * 1024
+UPLOAD_CLEAN_INTERVAL = 60
+
+# 6. Micro-batching: concurrent requests are coalesced into one YOLO call of up to
+# BATCH_SIZE images, waiting at most MAX_BATCH_LATENCY seconds to fill a batch
+BATCH_SIZE = 8
+MAX_BATCH_LATENCY = 0.05
+
+# 7. Inference settings, resolved once and passed on every call (FP16 only on CUDA)
+IMG_SIZE = 640
+USE_CUDA = torch.cuda.is_available()
+# conf/iou/max_det bound how many candidate boxes reach NMS; per-class NMS (agnostic_nms=False)
+# is what the per-part pricing expects
+PREDICT_KW = dict(
+    imgsz=IMG_SIZE, half=USE_CUDA, device=0 if USE_CUDA else 'cpu', verbose=False,
+    conf=0.35, iou=0.5, max_det=50, agnostic_nms=False,
+)
+
+# Input size is fixed at IMG_SIZE, so let cuDNN benchmark and cache the fastest conv algorithms
+torch.backends.cudnn.benchmark = True
+
+INFERENCE_QUEUE = None
+
+@asynccontextmanager
+async def lifespan(app):
+    """Starts the inference batching task and the upload cleaner for the lifetime of the server."""
+    global INFERENCE_QUEUE
+    INFERENCE_QUEUE = asyncio.Queue()
+    batcher = asyncio.create_task(batch_worker(INFERENCE_QUEUE))
+    threading.Thread(target=upload_cleaner, name='upload-cleaner', daemon=True).start()
+    yield
+    batcher.cancel()
+
+app = FastAPI(lifespan=lifespan)
+app.mount('/static', StaticFiles(directory='static'), name='static')
+
+# Every upload gets a unique filename and is never rewritten, so browsers may cache it forever
+UPLOAD_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+@app.middleware('http')
+async def limit_upload_size(request: Request, call_next):
+    # Reject oversized uploads from the headers, before Starlette reads and parses the body
+    if request.method == 'POST' and request.url.path == '/predict':
+        content_length = request.headers.get('content-length')
+        if content_length is None:
+            return render_form(request, 'Missing Content-Length. Please upload the image again.', status_code=411)
+        if not content_length.isdigit():
+            return render_form(request, 'Invalid Content-Length header.', status_code=400)
+        if int(content_length) > MAX_CONTENT_LENGTH:
+            return render_form(request, 'File too large. Please upload an image up to 16MB.', status_code=413)
+    return await call_next(request)
+
+@app.middleware('http')
+async def cache_uploads(request: Request, call_next):
+    # Only successful responses for uploaded/annotated images are marked cacheable
+    response = await call_next(request)
+    if request.url.path.startswith('/static/uploads/') and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = UPLOAD_CACHE_CONTROL
+    return response
+
+templates = Jinja2Templates(directory='templates')
+# Templates never change at runtime: compile each once and skip the mtime check on every render
+templates.env.auto_reload = False
+templates.env.cache = {}
+
+# Ensure the upload folder exists
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# Pool for persisting the original upload, so its disk write overlaps inference instead
+# of running before it
+IO_POOL = ThreadPoolExecutor(max_workers=4)
+
+# --- GLOBAL DATA AND MODEL LOADING ---
+CAR_PRICES = {}
+AVAILABLE_BRANDS = ()
+PRICE_TABLE = {}
+MODEL = None
+
+# Part names indexed by class ID (MUST match your training data)
+# Adjust this tuple if your model uses different class names or order
+CLASS_NAMES = ('Bonnet', 'Bumper', 'Dickey', 'Door', 'Fender', 'Light', 'Windshield')
+
+def build_price_table(car_prices):
+    """Maps (brand, model) to a tuple of part prices indexed by class ID (None where unpriced)."""
+    return {
+        (brand, model): tuple(model_prices.get(part_name) for part_name in CLASS_NAMES)
+        for brand, models in car_prices.items()
+        for model, model_prices in models.items()
+    }
+
+def load_data():
+    """Loads car parts prices from the JSON file."""
+    global CAR_PRICES, AVAILABLE_BRANDS, PRICE_TABLE
+    try:
+        # NOTE: This assumes car_parts_prices.json is in the same directory as main.py
+        with open(PRICE_JSON_PATH, 'r') as f:
+            CAR_PRICES = json.load(f)
+            AVAILABLE_BRANDS = tuple(sorted(CAR_PRICES))
+            PRICE_TABLE = build_price_table(CAR_PRICES)
+        print(f"✓ Pricing data loaded successfully from: {PRICE_JSON_PATH}")
+    except FileNotFoundError:
+        print(f"❌ ERROR: Price file not found at '{PRICE_JSON_PATH}'. Pricing will fail.")
+    except json.JSONDecodeError:
+        print(f"❌ ERROR: Could not parse JSON data in '{PRICE_JSON_PATH}'.")
+
+load_data()
+
+# Base context for predict.html; only the small brand list is passed, models are fetched
+# per brand from /api/models/<brand>
+TEMPLATE_DATA = {'brands': AVAILABLE_BRANDS}
+
+# Load YOLO model
+try:
+    # Use global variable for the model
+    MODEL = YOLO(MODEL_PATH)
+    MODEL_WEIGHTS = MODEL_PATH
+    print(f"✓ Model loaded successfully from: {MODEL_PATH}")
+except Exception as e:
+    print(f"❌ ERROR: Could not load YOLO model from {MODEL_PATH}. Using 'yolov8n.pt' as fallback. Error: {e}")
+    # Fallback model is used if the specified model path fails
+    MODEL = YOLO('yolov8n.pt')
+    MODEL_WEIGHTS = 'yolov8n.pt'
+
+def export_model(pt_model, weights_path):
+    """Returns an exported copy of the model (TensorRT on CUDA, ONNX otherwise), re-exporting it when missing or stale."""
+    export_format = 'engine' if USE_CUDA else 'onnx'
+    exported_path = f"{os.path.splitext(weights_path)[0]}.{export_format}"
+    try:
+        # An export older than the weights belongs to a previous (retrained/replaced) model
+        stale = os.path.exists(exported_path) and os.path.getmtime(weights_path) > os.path.getmtime(exported_path)
+        if stale or not os.path.exists(exported_path):
+            print(f"Exporting {weights_path} to {export_format}, this only happens when the weights change...")
+            # dynamic=True keeps any batch size up to BATCH_SIZE usable by the batcher
+            exported_path = pt_model.export(format=export_format, half=USE_CUDA, imgsz=IMG_SIZE, batch=BATCH_SIZE, dynamic=True)
+        model = YOLO(exported_path, task='detect')
+        print(f"✓ Using exported model: {exported_path}")
+        return model
+    except Exception as e:
+        print(f"❌ ERROR: Could not export/load {export_format} model. Using PyTorch weights. Error: {e}")
+        # Remove a broken or partly written export so the next start exports again
+        if os.path.exists(exported_path):
+            try:
+                os.remove(exported_path)
+            except OSError as remove_error:
+                print(f"❌ ERROR: Could not remove '{exported_path}'. Error: {remove_error}")
+        # Exported models are already fused; only the PyTorch fallback needs it
+        pt_model.fuse()
+        return pt_model
+
+MODEL = export_model(MODEL, MODEL_WEIGHTS)
+
+def warmup_model():
+    """Runs one dummy inference so the first request doesn't pay for setup."""
+    try:
+        with torch.inference_mode():
+            MODEL.predict(np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8), **PREDICT_KW)
+        print(f"✓ Model warmed up on {PREDICT_KW['device']} (half={PREDICT_KW['half']})")
+    except Exception as e:
+        print(f"❌ ERROR: Model warmup failed, first request will be slower. Error: {e}")
+
+warmup_model()
+
+# Every model stage of the analysis, keyed by name. Further models (e.g. a severity
+# classifier) go here so they run once per batch alongside the detector.
+PIPELINE = {'detect': MODEL}
+
+def run_pipeline(images):
+    """Runs each pipeline stage once over the whole batch; returns one {stage: result} dict per image."""
+    # inference_mode is thread-local, so it is entered here in the threadpool thread that runs the batch
+    with torch.inference_mode():
+        outputs = {name: model(images, **PREDICT_KW) for name, model in PIPELINE.items()}
+    return [dict(zip(outputs, image_outputs)) for image_outputs in zip(*outputs.values())]
+
+async def batch_worker(queue):
+    """Collects queued (image, future) pairs into batches and resolves each future with its image's outputs."""
+    loop = asyncio.get_running_loop()
+    while True:
+        # Block for the first image, then take more until the batch is full or
+        # MAX_BATCH_LATENCY has passed, whichever comes first
+        batch = [await queue.get()]
+        deadline = loop.time() + MAX_BATCH_LATENCY
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            # Inference is blocking, so it runs in the threadpool to keep the event loop free
+            outputs = await run_in_threadpool(run_pipeline, [image for image, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        # A future is already done if its client went away while waiting
+        for (_, future), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
+
+# --- UTILITIES ---
+
+def calculate_prices(car_brand, car_model, class_counts):
+    """Calculates the estimated cost from per-class detection counts (indexed by class ID) for the selected brand/model."""
+    prices = {}
+
+    # Check if brand and model exist in the loaded data
+    model_prices = PRICE_TABLE.get((car_brand, car_model))
+    if model_prices is None:
+        print(f"WARNING: Price data not found for {car_brand} - {car_model}. Cannot calculate prices.")
+        return {}
+
+    # Part names, prices and counts are all indexed by class ID; zip stops at CLASS_NAMES,
+    # so class IDs beyond it (e.g. from the fallback model) are ignored
+    for part_name, price_per_part, count in zip(CLASS_NAMES, model_prices, class_counts.tolist()):
+        if not count:
+            continue
+
+        # Check if the detected part has a price defined for the selected model
+        if price_per_part is not None:
+            total_price = price_per_part * count
+            prices[part_name] = {
+                'count': count,
+                'price': price_per_part,
+                'total': total_price
+            }
+        else:
+            print(f"WARNING: Part '{part_name}' detected but no price found for {car_model}.")
+
+    return prices
+
+def sniff_image_type(data):
+    """Returns 'jpg' or 'png' based on the magic bytes at the start of the data, else None."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    return None
+
+# JPEG quality / PNG compression used when writing the annotated image
+JPEG_QUALITY = 85
+PNG_COMPRESSION = 3
+
+def save_annotated(path, result):
+    """Draws the detections and writes them with OpenCV's encoder (skips the PIL re-encode)."""
+    if path.lower().endswith('.png'):
+        params = [int(cv2.IMWRITE_PNG_COMPRESSION), PNG_COMPRESSION]
+    else:
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
+    # cv2.imwrite reports encode/write failures by returning False rather than raising
+    if not cv2.imwrite(path, result.plot(), params):
+        raise OSError(f"cv2.imwrite failed for {path}")
+
+def save_bytes(path, data):
+    """Writes raw uploaded bytes to disk (run on IO_POOL)."""
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def clean_uploads():
+    """Deletes the oldest files in UPLOAD_FOLDER until its total size is under MAX_UPLOAD_FOLDER_BYTES."""
+    files = []
+    with os.scandir(UPLOAD_FOLDER) as entries:
+        for entry in entries:
+            # Another worker's cleaner may delete files mid-scan; skip those
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= MAX_UPLOAD_FOLDER_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # One undeletable file must not stop the rest of the pass
+            print(f"❌ ERROR: Could not delete '{path}'. Error: {e}")
+            continue
+        total_size -= size
+
+def upload_cleaner():
+    """Runs clean_uploads every UPLOAD_CLEAN_INTERVAL seconds (daemon thread)."""
+    while True:
+        try:
+            clean_uploads()
+        except OSError as e:
+            print(f"❌ ERROR: Could not clean '{UPLOAD_FOLDER}'. Error: {e}")
+        time.sleep(UPLOAD_CLEAN_INTERVAL)
+
+def submit_io(fn, *args):
+    """Schedules a disk write on IO_POOL and returns its concurrent.futures.Future."""
+    return IO_POOL.submit(fn, *args)
+
+def render_form(request, error=None, status_code=200):
+    """Renders the upload form, optionally with an error message."""
+    # A fresh (one-key) dict per render: TemplateResponse stores the request in the context,
+    # so TEMPLATE_DATA itself must never be passed in
+    context = {**TEMPLATE_DATA, 'error': error} if error else dict(TEMPLATE_DATA)
+    return templates.TemplateResponse(request, 'predict.html', context, status_code=status_code)
+
+# --- ROUTES ---
+
+@app.get('/')
+async def home():
+    # Direct users to the main prediction page immediately
+    return RedirectResponse(app.url_path_for('predict_damage'))
+
+@app.get('/predict', name='predict_damage')
+async def predict_form(request: Request):
+    # GET request handler (Renders the upload form)
+    return render_form(request)
+
+@app.get('/api/models/{brand}')
+async def brand_models(brand: str):
+    # The form loads a brand's models on demand instead of embedding the whole price list
+    if brand not in CAR_PRICES:
+        raise HTTPException(status_code=404, detail=f"Unknown brand: {brand}")
+    return sorted(CAR_PRICES[brand])
+
+@app.post('/predict')
+async def predict(
+    request: Request,
+    image: Optional[UploadFile] = File(None),
+    car_brand: Optional[str] = Form(None),
+    car_model: Optional[str] = Form(None),
+):
+    # Check if the model was loaded successfully before proceeding with prediction
+    if not MODEL:
+        return render_form(request, "The YOLO model failed to load. Cannot perform damage analysis.")
+
+    if not all([image, car_brand, car_model]):
+        return render_form(request, 'Please select a car and upload an image.')
+
+    # The body size was already checked against MAX_CONTENT_LENGTH by limit_upload_size
+    buf = await image.read()
+    if not buf:
+        return render_form(request, 'Please upload an image.')
+
+    # The file type comes from the content itself, not the client-supplied filename
+    extension = sniff_image_type(buf)
+    if not extension:
+        return render_form(request, 'Invalid file type. Please upload a PNG, JPG, or JPEG image.')
+
+    # Prepare file paths (the uploaded filename is not used, so it needs no sanitizing)
+    # Uploads are served publicly under /static/uploads, so IDs must be unguessable, not just
+    # unique: 64 random bits keep one user from stepping to another user's car photos
+    unique_id = secrets.token_hex(8)
+    original_filename = f"original_{unique_id}.{extension}"
+    detected_filename = f"detected_{unique_id}.{extension}"
+
+    original_image_path = os.path.join(UPLOAD_FOLDER, original_filename)
+    detected_image_path = os.path.join(UPLOAD_FOLDER, detected_filename)
+
+    # Files remain in /static/uploads for display
+    try:
+        # 1. Decode the upload in memory; YOLO takes the ndarray directly, no re-read from disk
+        img = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return render_form(request, 'Could not read the uploaded image. Please upload a valid PNG or JPEG.')
+
+        # The original is only persisted because the estimate page links to it. The raw
+        # upload bytes are written as-is (no re-encode) on IO_POOL so the write overlaps
+        # inference; it is awaited before responding below.
+        original_write = submit_io(save_bytes, original_image_path, buf)
+
+        # 2. Make predictions using YOLO
+        # The image is queued for batch_worker, which shares one batched forward between
+        # concurrent requests. We save the annotated result manually below.
+        future = asyncio.get_running_loop().create_future()
+        await INFERENCE_QUEUE.put((img, future))
+        outputs = await future
+
+        result = outputs['detect']
+        original_image_url = app.url_path_for('static', path=f'uploads/{original_filename}')
+
+        # Check for results before accessing boxes
+        if result and result.boxes:
+            # One device->host copy for all boxes, then count per class ID
+            class_ids = result.boxes.cls.to(torch.int64).cpu().numpy()
+            class_counts = np.bincount(class_ids, minlength=len(CLASS_NAMES))
+
+            # 3. Save the image with detections to the correct path
+            # Drawing and encoding take tens of milliseconds for large images, so this write is
+            # awaited (in the threadpool, off the event loop) rather than backgrounded: nothing
+            # would otherwise guarantee the file exists when the browser requests it.
+            await run_in_threadpool(save_annotated, detected_image_path, result)
+            detected_image_url = app.url_path_for('static', path=f'uploads/{detected_filename}')
+
+            # 4. Calculate estimation using JSON data
+            part_prices = calculate_prices(car_brand, car_model, class_counts)
+        else:
+            # Handle case where no detections are made
+            part_prices = {}
+            # If no damage is detected, just show the original image in both views;
+            # no separate 'detected' file is written.
+            detected_image_url = original_image_url
+
+        # The page links to the original (in both panes when nothing was detected), so it must
+        # be on disk first; this is almost always already done, and a failed write raises here
+        await asyncio.wrap_future(original_write)
+
+        return templates.TemplateResponse(
+            request,
+            'estimate.html',
+            {
+                'original_image': original_image_url,
+                'detected_image': detected_image_url,
+                'part_prices': part_prices,
+                'car_info': {'brand': car_brand, 'model': car_model},
+            },
+        )
+
+    except Exception as e:
+        print(f"An error occurred during prediction: {e}")
+        return render_form(request, f"An unexpected error occurred during analysis: {e}")
+
+if __name__ == '__main__':
+    # `python main.py --export-only` stops here: importing this module has already loaded,
+    # exported (if needed) and warmed up the model. Run it before the first gunicorn start
+    # so a slow TensorRT export doesn't exceed the gunicorn worker timeout.
+    if '--export-only' in sys.argv:
+        print(f"✓ Model ready, exiting without starting the server: {MODEL_WEIGHTS}")
+        sys.exit(0)
+
+    # Run a single Uvicorn worker: each worker has its own model and batching queue, so one
+    # process lets concurrent requests batch together instead of splitting across workers
+    # (equivalent to: uvicorn main:app --workers 1 --port 8000)
+    # For production, use gunicorn instead: gunicorn -c gunicorn_conf.py main:app
+    # The app object is passed instead of the 'main:app' import string, so uvicorn doesn't
+    # import this module a second time and load, export and warm up the model twice
+    import uvicorn
+    uvicorn.run(app, port=8000)